@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 #
 # git-sccsimport -- Import deltas collectively from SCCS files into git
 #
@@ -56,23 +56,13 @@
 #
 # - what to do with the text from any 'm', 'q', and 't' flags?
 #
-# - consider incremental import support
+# - incremental import support (--incremental) only keeps the last imported
+#   delta's timestamp
 #
-#   - it already essentially works by brute force (full re-import), but it could
-#     be optimized, and with new calling conventions it might work like:
-#
-#	cd my-project-converted-to-git
-#	git-sccsimport --incr $PROJECTDIR [...]
-#
-#   - might keep a rev list ala git-cvsimport (or just last rev?)
-#
-#     - or does the last rev's timestamp suffice?
+#   - might keep a rev list ala git-cvsimport?
 #
 #   - how does this interact with branches or does it matter?
 #
-#   - this might help in situations where something happens to cause a diverging
-#     path, e.g. a tag is applied in a different place.
-#
 # - there probably should be a --quiet option to suppress progress info
 #
 """A fast git importer for SCCS files.
@@ -109,27 +99,78 @@ of the import with "git reset --hard <new-tip>".  Note though that this will
 cause other clones to see history being rewritten, but here this is intended and
 any other clones just have to deal with it.
 
+Alternatively the --incremental option can be used for successive imports.
+After each successful import the timestamp of the newest delta imported is
+recorded in refs/sccsimport/<branch>, and later runs only import deltas which
+are newer than that, adding them on top of the existing branch.  Note that an SCCS
+delta made with a timestamp that is not newer than the last import will be
+ignored.
+
 I tried this on a 32M code repository in SCCS and it produced a 36M git
 repository.
 
 """
+import calendar
+import collections
+import concurrent.futures
 import datetime
 import errno
+import functools
+import hashlib
+import io
+import mmap
+import operator
 import optparse
 import os
 import os.path
 import pwd
+import queue
 import re
 import resource
+import shutil
 import stat
-import string
 import subprocess
 import sys
-import time
+import tempfile
+import threading
+import zoneinfo
+
+SCCS_ESCAPE = b"\x01"
+
+# The start of every ^Ad line in the delta table, and the start of the
+# ^AT line which ends the header.
+#
+DELTA_LINE = b"\n" + SCCS_ESCAPE + b"d "
+HEADER_END = b"\n" + SCCS_ESCAPE + b"T"
+
+# The flag which marks an encoded (binary) SCCS file.
+#
+ENCODED_FLAG_RE = re.compile(rb"^\x01f e 1$", re.M)
 
-from distutils.version import LooseVersion
+# The checksum line which starts every SCCS file, i.e. its magic number.
+#
+CHECKSUM_LINE_RE = re.compile(rb"\x01h\d{5}\n")
+CHECKSUM_LINE_LEN = len(b"\x01h00000\n")
 
-SCCS_ESCAPE = chr(1)
+# A whole delta table entry:
+#
+#	^As <inserted>/<deleted>/<unchanged>
+#	^Ad <type> <SID> <yy/mm/dd> <hh:mm:ss> <user> <seqno> <parent-seqno>
+#	^Ai, ^Ax, and ^Ag lists of included, excluded, and ignored seqnos
+#	^Am lines of MR numbers
+#	^Ac lines of comments
+#	^Ae
+#
+DELTA_ENTRY_RE = re.compile(rb"^\x01s (\S+)\n"
+			    rb"\x01d ([DR]) ([.0-9]+) (\S+) (\S+) (\S+) (\d+) (\d+)\n"
+			    rb"((?:\x01[ixg][^\n]*\n)*)"
+			    rb"((?:\x01m[^\n]*\n)*)"
+			    rb"((?:\x01c[^\n]*\n)*)"
+			    rb"\x01e$", re.M)
+
+# A UTC offset as git wants it, e.g. "-0800", in an author map or --tz.
+#
+UTC_OFFSET_RE = re.compile(r"[+-]\d{4}")
 
 # this will normally not be used -- see the AuthorMap option....
 #
@@ -137,11 +178,14 @@ MAIL_DOMAIN = None
 
 DEFAULT_USER_TZ = "+0000"
 
-UNIX_EPOCH = time.mktime(datetime.datetime(1970, 1, 1,
-					   0, 0, 0, 0,
-					   None).timetuple())
 IMPORT_REF = None
 
+# The ref which holds the state needed by --incremental, i.e. a blob
+# containing the timestamp of the newest delta imported so far into
+# the branch, so each branch has its own.
+#
+STATE_REF = None
+
 
 # Two checkins separated by more than FUZZY_WINDOW will never be considered part
 # of the same commit; N.B. even if they have the same non-empty comment,
@@ -155,6 +199,16 @@ verbose = False
 
 DoTags = True
 
+# Also have val(1) check each SCCS file before it is imported.
+STRICT_VALIDATE = False
+
+# The most memory to use for delta bodies extracted but not yet imported.
+BODY_CACHE_LIMIT = 256 << 20
+
+# Always extract the delta bodies with get(1), even when WeaveBodies()
+# could do it.
+USE_GET = False
+
 class ImportFailure(Exception):
 	pass
 
@@ -167,11 +221,71 @@ class UsageError(Exception):
 class AbstractClassError(Exception):
 	pass
 
+class NotSccsFile(Exception):
+	pass
+
+
+def Decode(data):
+	"""Decode text from an SCCS file or from the output of a command.
+
+	Bytes which are not valid UTF-8 survive the trip through a str and
+	are restored exactly by Encode().
+
+	"""
+	return data.decode("utf-8", "surrogateescape")
+
+
+def Encode(text):
+	"""Encode text previously returned by Decode() back into bytes."""
+	return text.encode("utf-8", "surrogateescape")
+
+
+@functools.lru_cache(maxsize=None)
+def UTCOffsetSeconds(tz):
+	"""Convert a UTC offset in the "[+-]hhmm" form into seconds.
+
+	This is done for every delta, but there are only ever a handful of
+	distinct offsets, so the results are cached.
+
+	"""
+	try:
+		seconds = int(tz[1:3]) * 60 * 60 + int(tz[3:5]) * 60
+	except ValueError:
+		raise ImportFailure("Unexpected UTC offset format: %s" % (tz,))
+	if tz[0] == "-":
+		return -seconds
+	return seconds
+
+
+@functools.lru_cache(maxsize=None)
+def GetZone(name):
+	"""Get the named time zone, e.g. "America/Vancouver"."""
+	return zoneinfo.ZoneInfo(name)
+
+
+def LocalUTCOffset(tz, wallclock):
+	"""Return the "[+-]hhmm" UTC offset of tz at local time wallclock.
+
+	tz is either already a UTC offset, in which case it is returned as
+	is (the usual case, so it is dealt with first), or the name of a
+	time zone.  wallclock is in seconds as given by calendar.timegm().
+
+	"""
+	if tz[0] in "+-":
+		return tz
+	local = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=wallclock)
+	minutes = int(local.replace(tzinfo=GetZone(tz)).utcoffset().total_seconds()) // 60
+	sign = "+"
+	if minutes < 0:
+		sign = "-"
+		minutes = -minutes
+	return "%s%02d%02d" % (sign, minutes // 60, minutes % 60)
+
 
 def Usage(who, retval, f, e):
 	if e:
-		print >>f, e
-		print >>f, ("usage: %s sccs-file [sccs-file...]" % (who,))
+		print(e, file=f)
+		print("usage: %s sccs-file [sccs-file...]" % (who,), file=f)
 
 	if retval:
 		sys.exit(retval)
@@ -187,7 +301,7 @@ def NotImporting(file, sid, reason):
 		msg = ("%s: not importing this file: %s"
 		       % (file, reason))
 
-	print >>sys.stderr, msg
+	print(msg, file=sys.stderr)
 
 
 def ReportCommandFailure(command, returncode, errors):
@@ -199,52 +313,180 @@ def ReportCommandFailure(command, returncode, errors):
 	else:
 		msg = ("%s: returned exit status %d" % (command, returncode,))
 
-	raise CommandFailure, ("%s\n%s" % (errors, msg,))
+	raise CommandFailure("%s\n%s" % (errors, msg,))
+
+
+def RunCommand(commandline, input=None, capture_stderr=True):
+	"""Run a command and return its output.
 
+	If capture_stderr is False then the command's stderr is simply our
+	own, and its stdout can be read without the help of communicate().
 
-def RunCommand(commandline):
+	"""
 	try:
 		if debug:
 			msg = ("Running command: %s\n"
 			       % (" ".join(commandline),))
 			sys.stderr.write(msg)
 
-		child = subprocess.Popen(commandline,
-					 close_fds = True,
-					 stdin =subprocess.PIPE,
-					 stdout=subprocess.PIPE,
-					 stderr=subprocess.PIPE)
-		output, errors = child.communicate(None)
+		if capture_stderr or input is not None:
+			child = subprocess.Popen(commandline,
+						 close_fds = True,
+						 stdin =subprocess.PIPE,
+						 stdout=subprocess.PIPE,
+						 stderr=subprocess.PIPE)
+			output, errors = child.communicate(input)
+			errors = Decode(errors)
+		else:
+			child = subprocess.Popen(commandline,
+						 close_fds = True,
+						 stdin =subprocess.DEVNULL,
+						 stdout=subprocess.PIPE)
+			with child.stdout:
+				output = child.stdout.read()
+			child.wait()
+			errors = None
 		# Some stderr output is normal (warnings, etc.)
 		if child.returncode != 0:
 			ReportCommandFailure(commandline[0], child.returncode, errors)
 		else:
 			if errors and debug:
-				print >>sys.stderr, ("%s stderr: %s" % (commandline[0], errors,))
+				print("%s stderr: %s" % (commandline[0], errors,), file=sys.stderr)
 			return output
-	except OSError, oe:
+	except OSError as oe:
 		msg = ("Failed to run '%s': %s (%s)"
 		       % (commandline[0], oe,
 			  errno.errorcode[oe.errno]))
 		if debug:
 			sys.stderr.write(msg + "\n")
-		raise OSError, msg
+		raise OSError(msg)
 	# for now we'll also just convert CommandFailure to ImportFailure
-	except CommandFailure, cmd_failure:
+	except CommandFailure as cmd_failure:
 		if verbose:
-			print >>sys.stderr, (cmd_failure)
-		raise ImportFailure, cmd_failure
+			print(cmd_failure, file=sys.stderr)
+		raise ImportFailure(cmd_failure)
+
 
+def WeaveBodies(sfile, seqnos):
+	"""Extract the bodies of several deltas straight from the SCCS weave.
 
-def GetBody(sfile, seqno, expand_keywords):
-	commandline = GET.split(" ")
-	options = ["-p", "-s", ("-a%d" % (seqno,))]
+	The file is read just once and get(1) is not run at all.  Only the
+	plain cases are handled though, so None is returned (and get must
+	be used instead) if the file is encoded, if any delta includes,
+	excludes, or ignores other deltas, or if anything else in the file
+	is not understood.  Keywords are never expanded, just as with
+	"get -k".
+
+	"""
+	with open(sfile, "rb") as f:
+		data = f.read()
+	end = data.find(HEADER_END)
+	if end < 0:
+		return None
+	header = data[:end + 1]
+	if ENCODED_FLAG_RE.search(header):
+		return None
+
+	parents = {}
+	for m in DELTA_ENTRY_RE.finditer(header):
+		if m.group(9):
+			return None
+		parents[int(m.group(7))] = int(m.group(8))
+
+	# The deltas applied to get each body are just its ancestors.
+	applied = {}
+	for seqno in seqnos:
+		ancestors = set()
+		s = seqno
+		while s:
+			if s not in parents or s in ancestors:
+				return None
+			ancestors.add(s)
+			s = parents[s]
+		applied[seqno] = ancestors
+
+	# A text line is in a body if every insertion around it has been
+	# applied and no deletion around it has.
+	bodies = dict([(seqno, []) for seqno in seqnos])
+	inserts = []
+	deletes = []
+	visible = list(bodies.values())
+	body_start = data.find(b"\n", end + 1) + 1
+	if body_start == 0:
+		return None
+	lines = data[body_start:].split(b"\n")
+	if lines[-1] == b"":
+		lines.pop()
+	for line in lines:
+		if not line.startswith(SCCS_ESCAPE):
+			for body in visible:
+				body.append(line)
+			continue
+		try:
+			serial = int(line[3:])
+		except ValueError:
+			return None
+		control = line[1:3]
+		if control == b"I ":
+			inserts.append(serial)
+		elif control == b"D ":
+			deletes.append(serial)
+		elif control == b"E " and serial in inserts:
+			inserts.remove(serial)
+		elif control == b"E " and serial in deletes:
+			deletes.remove(serial)
+		else:
+			return None
+		visible = [bodies[seqno] for seqno in seqnos
+			   if (all([n in applied[seqno] for n in inserts])
+			       and not any([n in applied[seqno] for n in deletes]))]
+
+	if inserts or deletes:
+		return None
+	return dict([(seqno, b"".join([line + b"\n" for line in body]))
+		     for seqno, body in bodies.items()])
+
+
+def GetBodies(sfile, seqnos, expand_keywords):
+	"""Extract the bodies of several deltas of one SCCS file at once.
+
+	The bodies are read straight from the weave if possible (see
+	WeaveBodies()).  Otherwise a single shell runs get(1) for each seqno,
+	writing each body to a file named after its seqno in a private
+	temporary directory, so that we fork just once per SCCS file instead
+	of once per delta.
+
+	"""
+	if not expand_keywords and not USE_GET:
+		result = WeaveBodies(sfile, seqnos)
+		if result is not None:
+			return result
+
+	options = "-p -s"
 	if not expand_keywords:
-		options.append("-k")
+		options += " -k"
+	script = ('f="$1"; d="$2"; shift 2; '
+		  'for a; do %s %s -a"$a" "$f" > "$d/$a" || exit $?; done'
+		  % (GET, options,))
+
+	tmpdir = tempfile.mkdtemp(prefix="git-sccsimport.")
+	try:
+		commandline = ["sh", "-c", script, "sh", sfile, tmpdir]
+		commandline.extend([str(seqno) for seqno in seqnos])
+		# get(1) is silenced with -s, so anything it says is an error
+		RunCommand(commandline, capture_stderr=False)
+		result = {}
+		for seqno in seqnos:
+			f = open(os.path.join(tmpdir, str(seqno)), "rb")
+			try:
+				result[seqno] = f.read()
+			finally:
+				f.close()
 
-	options.append(sfile)
-	commandline.extend(options)
-	return RunCommand(commandline)
+		return result
+
+	finally:
+		shutil.rmtree(tmpdir)
 
 
 def FileMode(filename):
@@ -252,22 +494,68 @@ def FileMode(filename):
 
 
 class SccsFileQueryBase(object):
+	"""Common parts of the SCCS file query classes.
+
+	Subclasses implement QueryFile(filename), which must return a tuple
+	of the list of SIDs in the delta table and a dict mapping each SID
+	to the list of properties of that delta, or raise NotSccsFile.  The
+	header of each file is read just once, by SccsFile, and the
+	properties are handed straight to each Delta.
+
+	"""
+	def __init__(self, *args, **kwargs):
+		super(SccsFileQueryBase, self).__init__(*args, **kwargs)
+
+	def QueryFile(self, filename):
+		raise AbstractClassError("QueryFile")
+
 	@staticmethod
-	def HeaderLines(filename):
-		header_end = "^%cT" % (SCCS_ESCAPE,)
-		result = []
+	def IsValidSccsFile(filename):
+		"""XXX A very incomplete validation of an SCCS file.
+
+		Only the form of the checksum line is checked, which needs just
+		one small read (and no prs or val process).
+
+		"""
+		fd = os.open(filename, os.O_RDONLY)
 		try:
-			f = open(filename, "rb")
-			for line in f.readlines():
-				if line.startswith(header_end):
-					break
-				else:
-					result.append(line)
+			line = os.read(fd, CHECKSUM_LINE_LEN)
+			return CHECKSUM_LINE_RE.match(line) is not None
+		finally:
+			os.close(fd)
 
-			return result
+	@staticmethod
+	def MapFile(filename):
+		"""Map the SCCS file read-only into memory.
+
+		Returns None for an empty file (which cannot be mapped).
 
+		"""
+		fd = os.open(filename, os.O_RDONLY)
+		try:
+			if os.fstat(fd).st_size == 0:
+				return None
+			return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
 		finally:
-			f.close()
+			os.close(fd)
+
+	@staticmethod
+	def Header(filename):
+		"""Return the SCCS file up to (but not including) the first ^AT line.
+
+		Only the header is touched; the body is never read in.
+
+		"""
+		mm = SccsFileQueryBase.MapFile(filename)
+		if mm is None:
+			return b""
+		try:
+			end = mm.find(HEADER_END)
+			if end < 0:
+				end = len(mm)
+			return mm[:end + 1]
+		finally:
+			mm.close()
 
 
 class SccsFileQuerySlow(SccsFileQueryBase):
@@ -277,184 +565,205 @@ class SccsFileQuerySlow(SccsFileQueryBase):
 		commandline = PRS.split(" ")
 		commandline.extend(options)
 		return RunCommand(commandline)
-	@staticmethod
-	def RunVal(options):
-		commandline = VAL.split(" ")
-		commandline.extend(options)
-		return RunCommand(commandline)
 
-	@staticmethod
-	def FetchDeltaProperties(sid, filename):
-		fmt = (":Dy:/:Dm:/:Dd:%(esc)c"  # 0 delta creation date
-			   ":Th:::Tm:::Ts:%(esc)c" # 1 delta creation time (24h)
-			   ":C:%(esc)c"            # 2 checkin comments
-			   ":DS:%(esc)c"           # 3 seqno
-			   ":DP:%(esc)c"           # 4 parent seqno
-			   ":DT:%(esc)c"           # 5 delta type (R or D)
-			   ":I:%(esc)c"            # 6 SID
-			   ":MR:%(esc)c"           # 7 MR numbers
-			   ":P:%(esc)c"            # 8 Perpetrator (committer)
-			   % { 'esc': SCCS_ESCAPE })
-		cmdline = [("-d%s" % (fmt,)), ("-r%s" % (sid,)), filename]
-		propdata = SccsFileQuerySlow.RunPrs(cmdline)
-		#print >>sys.stderr, ("PRS = ", propdata)
-		return propdata.split(SCCS_ESCAPE)
+	# prs(1) output is text, so the escape is needed as a str here.
+	ESC = Decode(SCCS_ESCAPE)
+	END_OF_RECORD = ESC + ESC + "\n"
+
+	DELTA_FORMAT = (":Dy:/:Dm:/:Dd:%(esc)c"  # 0 delta creation date
+			":Th:::Tm:::Ts:%(esc)c" # 1 delta creation time (24h)
+			":C:%(esc)c"            # 2 checkin comments
+			":DS:%(esc)c"           # 3 seqno
+			":DP:%(esc)c"           # 4 parent seqno
+			":DT:%(esc)c"           # 5 delta type (R or D)
+			":I:%(esc)c"            # 6 SID
+			":MR:%(esc)c"           # 7 MR numbers
+			":P:%(esc)c"            # 8 Perpetrator (committer)
+			":DL:%(esc)c"           # 9 lines inserted/deleted/unchanged
+			":Dn::Dx::Dg:%(esc)c"   # 10 seqnos included, excluded, ignored
+			% { 'esc': ESC })
+
+	def QueryFile(self, filename):
+		"""Query the properties of every delta with a single prs run.
+
+		Each record is terminated by a doubled SCCS_ESCAPE so that
+		multi-line comments and MR lists cannot be confused with a
+		record boundary.
 
-	@staticmethod
-	def IsValidSccsFile(filename):
-		try:
-			output = SccsFileQuerySlow.RunVal([filename])
-			#print >>sys.stderr, ("%s: %s" % (VAL, output,))
-			return True
-		except ImportFailure:
-			return False
-		except OSError, oe:
-			print >>sys.stderr, ("\nVAL failed: %s" % (oe,))
-			sys.exit(1)
+		"""
+		if not self.IsValidSccsFile(filename):
+			raise NotSccsFile(filename)
+		esc = SccsFileQuerySlow.ESC
+		fmt = SccsFileQuerySlow.DELTA_FORMAT + esc
+		propdata = SccsFileQuerySlow.RunPrs(["-e", ("-d%s" % (fmt,)), filename])
+		propdata = Decode(propdata)
+		revisions = []
+		deltas = {}
+		for record in propdata.split(SccsFileQuerySlow.END_OF_RECORD):
+			if not record:
+				continue
+			props = record.split(esc)
+			revisions.append(props[6])
+			deltas[props[6]] = props
 
-	@staticmethod
-	def GetRevisionList(filename):
-		revisions = SccsFileQuerySlow.RunPrs(["-d:I: ", "-e", filename])
-		return revisions.split()
+		return revisions, deltas
 
 
-# XXX this is very incomplete!  (see "props" array creation)
 class SccsFileQueryFast(SccsFileQueryBase):
 	"""Extract information from SCCS files by parsing them directly."""
-	DELTA_RE = re.compile("^%cd D ([.0-9]*)" % (SCCS_ESCAPE,))
 
-	@staticmethod
-	def IsValidSccsFile(filename):
-		"""XXX A very incomplete validation of an SCCS file."""
-		try:
-			f = open(filename, "rb")
-			header = f.read(2)
-			return header[0] == SCCS_ESCAPE and header[1] == 'h'
-		finally:
-			f.close()
+	def QueryFile(self, filename):
+		"""Parse the whole delta table with one pass of DELTA_ENTRY_RE.
 
-	@staticmethod
-	def GetRevisionList(filename):
-		result = []
-		header_end = "^%cT" % (SCCS_ESCAPE,)
-		for line in SccsFileQueryBase.HeaderLines(filename):
-			m = SccsFileQueryFast.DELTA_RE.match(line)
-			if m:
-				result.append(m.group(1))
+		The properties are returned in the same order, and with the same
+		formatting, as those from SccsFileQuerySlow.
 
-		return result
-
-	@staticmethod
-	def FetchDeltaProperties(sid, filename):
-		found = False
-		props = []
-		comments = []
-		comment_leader = "%cc" % (SCCS_ESCAPE,)
-		for line in SccsFileQueryBase.HeaderLines(filename):
-			if not found:
-				m = SccsFileQueryFast.DELTA_RE.match(line)
-				if m and (sid == m.group(1)):
-					found = True
-					fields = line.split()
-					props = [ fields[3], # 0 creation date
-						  fields[4], # 1 creation time
-						  None,      # XXX 2 checkin comment
-						  fields[6], # 3 seqno
-						  fields[7], # 4 parent seqno
-						  'D',       # XXX 5 delta type (R or D)
-						  fields[2], # 6 SID
-						  "",        # XXX 7 MR list
-						  fields[5], # 8 Perpetrator (committer)
-						  "yodel"    # XXX ???
-					]
-					continue
-				else:
-					if found:
-						if line.startswith(comment_leader):
-							comments.append(line[3:])
-						else:
-							break
-
-		if found:
-			props[2] = "\n".join(comments)
-			# print >>sys.stderr, "props: %s" % (props,)
-			return props
-		else:
-			return None
+		"""
+		revisions = []
+		deltas = {}
+		header = self.Header(filename)
+		# the header we have read anyway is enough to validate the file
+		if not CHECKSUM_LINE_RE.match(header):
+			raise NotSccsFile(filename)
+		entries = 0
+		for m in DELTA_ENTRY_RE.finditer(header):
+			entries += 1
+			(stats, dtype, sid, cdate, ctime, user,
+			 seqno, parent_seqno) = [Decode(g) for g in m.groups()[:8]]
+			# deltas removed with rmdel(1) are not listed by prs -e
+			# either, so they are skipped here too
+			if dtype == "R":
+				continue
+			incexcl = []
+			for line in m.group(9).splitlines():
+				if line[1:2] in b"ixg":
+					incexcl.extend(Decode(line[3:]).split())
+			mrs = [Decode(line[3:]) for line in m.group(10).splitlines()]
+			# prs(1) terminates each line of the comment with a newline
+			comment = "".join([Decode(line[3:]) + "\n"
+					   for line in m.group(11).splitlines()])
+			props = [ cdate,                # 0 creation date
+				  ctime,                # 1 creation time
+				  comment or "\n",     # 2 checkin comment
+				  seqno,                # 3 seqno
+				  parent_seqno,         # 4 parent seqno
+				  dtype,                # 5 delta type (R or D)
+				  sid,                  # 6 SID
+				  " ".join(mrs),        # 7 MR list
+				  user,                 # 8 Perpetrator (committer)
+				  stats,                # 9 lines inserted/deleted/unchanged
+				  " ".join(incexcl),    # 10 seqnos included, excluded, ignored
+			]
+			revisions.append(sid)
+			deltas[sid] = props
+
+		if entries != header.count(DELTA_LINE):
+			raise ImportFailure("%s: unexpected delta table format"
+					    % (filename,))
+
+		return revisions, deltas
+
+
+@functools.lru_cache(maxsize=None)
+def SccsFileQuery():
+	"""Factory method for objects that query SccsFileQuery objects.
 
+	The query objects keep no state, so just one is ever made.
 
-def SccsFileQuery():
-	"""Factory method for objects that query SccsFileQuery objects"""
-	return SccsFileQuerySlow()
+	"""
+	return SccsFileQueryFast()
 
 
 class Delta(object):
 	"""Represents the properties of an SCCS delta that we
 	import into git."""
-	def __init__(self, sccsfile, sid, qif, *args, **kwargs):
+
+	# There can be a very great many deltas, so do without a __dict__
+	# for each of them.
+	#
+	__slots__ = ("_sccsfile", "_sid", "_comment", "_seqno", "_parent_seqno",
+		     "_type", "_committer", "_mrs", "_same_body_as_parent",
+		     "_commit_key", "_ui", "_timestamp", "_git_timestamp")
+
+	def __init__(self, sccsfile, sid, props, *args, **kwargs):
 		super(Delta, self).__init__(*args, **kwargs)
 		self._sccsfile = sccsfile
 		self._sid = sid
-		self._qif = qif
-		self.FetchDeltaProperties()
+		self.SetDeltaProperties(props)
 
 	def __repr__(self):
 		return 'Delta(%s, "%s")' % (repr(self._sccsfile), self._sid)
 
-	def FetchDeltaProperties(self):
-		"""Query the properties of this delta from the SCCS file."""
-		props = self._qif.FetchDeltaProperties(self._sid,
-						       self._sccsfile._filename)
-		assert len(props)>1, "%s %s %s" % (self._sccsfile._filename, self._sid, props,)
-		#print >>sys.stderr, ("DeltaProperties: %s"
-		#		     % (props))
-		self.SetTimestamp(props[0], props[1])
+	def SetDeltaProperties(self, props):
+		"""Set the properties of this delta as queried from the SCCS file.
+
+		N.B.:  props[6] (the SID) is not checked as the query classes
+		always use it as the key for props.
+
+		"""
+		#print("DeltaProperties: %s" % (props,), file=sys.stderr)
 		(self._comment, self._seqno, self._parent_seqno, self._type,
-		 sidcheck, mrlist, self._committer, _) = props[2:]
-		#print >>sys.stderr, ("DeltaProperties: %s"
-		#		     % (self))
-		#print >>sys.stderr, ("DeltaProperties: comment:%s"
-		#		     % (self._comment))
-		#print >>sys.stderr, ("DeltaProperties: committer:%s"
-		#		     % (self._committer))
+		 _, mrlist, self._committer) = props[2:9]
+		#print("DeltaProperties: %s" % (self,), file=sys.stderr)
+		#print("DeltaProperties: comment:%s" % (self._comment,), file=sys.stderr)
+		#print("DeltaProperties: committer:%s" % (self._committer,), file=sys.stderr)
 		self._seqno = int(self._seqno)
 		self._parent_seqno = int(self._parent_seqno)
 		if self._comment == "\n":
 			self._comment = None
 
-		assert sidcheck==self._sid
 		self._mrs = mrlist.split()
+		# A delta which neither inserted nor deleted any lines (e.g. one
+		# made only to record a comment) has the same body as its parent,
+		# unless it also included, excluded, or ignored other deltas, or
+		# the keywords in it are to be expanded.
+		try:
+			inserted, deleted, unchanged = [int(n) for n in props[9].split("/")]
+		except (AttributeError, ValueError):
+			raise ImportFailure("%s: %s: unexpected line counts: %s"
+					    % (self._sccsfile._filename, self._sid, props[9],))
+		self._same_body_as_parent = (inserted == 0 and deleted == 0
+					     and not props[10].strip()
+					     and self._parent_seqno != 0
+					     and not EXPAND_KEYWORDS)
+		# Deltas can only be in the same commit if all of these match,
+		# and a delta without a comment is never merged with another.
+		if self._comment:
+			self._commit_key = (self._committer, tuple(self._mrs),
+					    self._comment)
+		else:
+			self._commit_key = None
 		self._ui = GetUserInfo(self._committer, MAIL_DOMAIN, DEFAULT_USER_TZ)
+		offset = self.SetTimestamp(props[0], props[1], self._ui.tz)
+		# We also pass timezone information from the AuthorMap (or local
+		# timezone) by setting the appropriate <offutc> value here.
+		# N.B. the timestamp must still be in UTC -- <offutc> is only
+		# used to advise formatting of timestamps in log reports and
+		# such.
+		self._git_timestamp = "%d %s" % (int(self._timestamp), offset,)
+
+	def SameBodyAsParent(self):
+		"""Returns True IFF this delta's body is the same as its parent's."""
+		return self._same_body_as_parent
 
 	def SameFuzzyCommit(self, other):
-		#print >>sys.stderr, ("SameFuzzyCommit: comparing\n1: %s with\n2: %s"
-		#		     % (self, other))
-		if self._comment != other._comment:
-			return False
-		elif self._committer != other._committer:
-			return False
-		elif self._mrs != other._mrs:
-			return False
-		else:
-			delta = abs(other._timestamp - self._timestamp)
-			if delta > FUZZY_WINDOW or self._comment == "":
-				return False
-			else:
-				return True
+		#print("SameFuzzyCommit: comparing\n1: %s with\n2: %s"
+		#      % (self, other), file=sys.stderr)
+		return (self._commit_key is not None
+			and self._commit_key == other._commit_key
+			and abs(other._timestamp - self._timestamp) <= FUZZY_WINDOW)
 
-	def SetTimestamp(self, checkin_date, checkin_time):
+	def SetTimestamp(self, checkin_date, checkin_time, tz):
 		try:
 			year, month, monthday = [int(f) for f in checkin_date.split("/")]
 		except ValueError:
-			raise ImportFailure, ("Unexpected date format: %s"
+			raise ImportFailure("Unexpected date format: %s"
 					      % (checkin_date,))
 		try:
 			h,m,s = [int(f) for f in checkin_time.split(":")]
 		except ValueError:
-			raise ImportFailure, ("Unexpected time format: %s"
+			raise ImportFailure("Unexpected time format: %s"
 					      % (checkin_time,))
-		microsec = 0
-
 		if year < 100:
 			# Apply the y2k rule (see the "Year 2000 Issues" section
 			# of the CSSC documentation).
@@ -463,21 +772,18 @@ class Delta(object):
 			else:
 				year += 1900
 
-		cdate = datetime.datetime(year, month, monthday,
-					  h, m, s,
-					  microsec, None)
-		lt = time.mktime(cdate.timetuple())
-		#
-		# XXX the timzone currently defaults to the host's timezone
-		# (i.e. assuming the import is being done on a machine in the
-		# same timezone as the original SCCS source server lived)
+		# SCCS records the local "wall clock" time of each delta.
+		# calendar.timegm() gives us the seconds since the Unix epoch
+		# as if that were UTC, without consulting the host's timezone
+		# (and without mktime()'s trouble around DST changes); the
+		# committer's UTC offset is then applied to get the real UTC
+		# timestamp required by git fast-import.
 		#
 		# With the addition of the AuthorMap file ala git-sccsimport
-		# then we could also adjust timestamps on a per-author basis,
-		# though that would also probably require use of the magical
-		# third-party "pytz" module.
+		# each author can have their own UTC offset, or a named zone
+		# whose offset depends on the date.
 		#
-		epoch_offset = time.mktime(time.gmtime(lt)) # convert to UTC
+		wallclock = calendar.timegm((year, month, monthday, h, m, s, 0, 0, 0))
 		#
 		# Maybe there could also be some option to change the timezone
 		# at some date (or list of dates), in order to handle cases
@@ -489,30 +795,19 @@ class Delta(object):
 		# the timestamp is from before that date, then add three hours.
 		#
 		if MoveDate is not None:
-			mvd = time.mktime(MoveDate.timetuple())
-			if lt < mvd:
-				lt += MoveOffset
+			if wallclock < MoveDate:
+				wallclock += MoveOffset
 
-		# We subtract UNIX_EPOCH to take account of the fact
-		# that the system epoch may in fact not be the same as the Unix
-		# epoch.
-		#
-		# git fast-import requires the timestamp to be measured in
-		# seconds since the Unix epoch.
-		#
-		self._timestamp = epoch_offset - UNIX_EPOCH
-
-	def GitTimestamp(self):
-		n = int(self._timestamp)
-		# We also pass timezone information from the AuthorMap (or local
-		# timezone) by setting the appropriate <offutc> value here.
-		# N.B. the timestamp must still be in UTC -- <offutc> is only
-		# used to advise formatting of timestamps in log reports and
-		# such.
-		return "%d %s" % (n, self._ui.tz,)
+		offset = LocalUTCOffset(tz, wallclock)
+		self._timestamp = wallclock - UTCOffsetSeconds(offset)
+		return offset
 
 	def GitComment(self):
-		"""Format a comment, noting any MRs as 'Issue' numbers"""
+		"""Format a comment, noting any MRs as 'Issue' numbers.
+
+		The comment is returned as bytes, ready to be sent to git.
+
+		"""
 		comment = "" # commit comment is mandatory
 		if self._comment:
 			comment = self._comment
@@ -526,35 +821,75 @@ class Delta(object):
 			comment += ": "
 			comment += ", ".join(map(lambda mr: '#' + mr, self._mrs))
 
-		return comment
+		return Encode(comment)
 
 	def SidLevel(self):
 		return int(self._sid.split(".")[0])
 	def SidRev(self):
 		return int(self._sid.split(".")[1])
 
+class BodyCache(object):
+	"""Limits the memory held by delta bodies not yet imported.
+
+	Each SccsFile extracts the bodies of all of its remaining deltas in
+	one go, but those deltas may be spread right through the import.
+	Once more than the limit is held, the bodies of the least recently
+	used files are dropped, to be extracted again if they are needed.
+
+	"""
+	def __init__(self, limit, *args, **kwargs):
+		super(BodyCache, self).__init__(*args, **kwargs)
+		self._limit = limit
+		self._size = 0
+		self._files = collections.OrderedDict()
+
+	def Added(self, sfile, size):
+		"""Note that sfile now holds size bytes more of bodies."""
+		self._files[sfile] = self._files.get(sfile, 0) + size
+		self._files.move_to_end(sfile)
+		self._size += size
+		while self._size > self._limit and len(self._files) > 1:
+			oldest, oldsize = self._files.popitem(last=False)
+			oldest._bodies = None
+			self._size -= oldsize
+
+	def Removed(self, sfile, size):
+		"""Note that sfile has handed out size bytes of its bodies."""
+		if sfile in self._files:
+			self._files[sfile] -= size
+			self._files.move_to_end(sfile)
+			self._size -= size
+
+
+BODY_CACHE = BodyCache(BODY_CACHE_LIMIT)
+
+
 class SccsFile(object):
-	def __init__(self, name, *args, **kwargs):
+	def __init__(self, name, st_mode=None, *args, **kwargs):
 		super(SccsFile, self).__init__(*args, **kwargs)
 		self._filename = name
 		qif = SccsFileQuery()
-		revisions = filter(self.GoodRevision, qif.GetRevisionList(name))
-		self._deltas = [Delta(self, sid, qif) for sid in revisions]
+		revisions, props = qif.QueryFile(name)
+		self._deltas = [Delta(self, sid, props[sid]) for sid in revisions
+				if self.GoodRevision(sid)]
+		self._bodies = None
+		self._blob_marks = {}
 		self._gitname = self.GitFriendlyName(self._GottenName())
-		if FileMode(self._filename) & 0111:
+		if st_mode is None:
+			st_mode = FileMode(self._filename)
+		if st_mode & 0o111:
 			self._gitmode = "755"
 		else:
 			self._gitmode = "644"
+		# The parts of the filemodify command for each of our deltas
+		# which come before and after the blob mark.
+		self._filemodify = (Encode("M %s :" % (self._gitmode,)),
+				    Encode(" %s\n" % (self._gitname,)))
 
 	gitname = property(lambda self: self._gitname)
 	gitmode = property(lambda self: self._gitmode)
 	filename = property(lambda self: self._filename)
 
-	@staticmethod
-	def IsValidSccsFile(filename):
-		qif = SccsFileQuery()
-		return qif.IsValidSccsFile(filename)
-
 	def __repr__(self):
 		return "SccsFile(r'%s')" % (self._filename,)
 
@@ -567,7 +902,16 @@ class SccsFile(object):
 
 		"""
 		if os.path.isabs(name):
-			raise ImportFailure, "%s is an absolute path name" % (name,)
+			raise ImportFailure("%s is an absolute path name" % (name,))
+		if os.sep == "/":
+			# The usual case is a name found by MakeDirWorklist(),
+			# which needs at most a leading "./" removed.
+			path = name
+			while path.startswith("./"):
+				path = path[2:]
+			parts = path.split("/")
+			if "" not in parts and "." not in parts and ".." not in parts:
+				return path
 		drive, path = os.path.splitdrive(name)
 		return os.path.normpath(path)
 
@@ -592,6 +936,49 @@ class SccsFile(object):
 
 		return os.path.join(head, tail)
 
+	def GetBody(self, seqno):
+		"""Return the body of the delta with the given seqno.
+
+		The bodies of all of our deltas which have not yet been imported
+		are extracted together the first time any one of them is asked
+		for (or again if BODY_CACHE has since dropped them), and each is
+		dropped as soon as it has been handed out.  The bodies of deltas
+		which are the same as their parent's are only extracted if asked
+		for.
+
+		"""
+		if self._bodies is None:
+			self._bodies = GetBodies(self._filename,
+						 [d._seqno for d in self._deltas
+						  if (d._seqno not in self._blob_marks
+						      and not d.SameBodyAsParent())],
+						 EXPAND_KEYWORDS)
+			BODY_CACHE.Added(self, sum([len(body) for body
+						    in self._bodies.values()]))
+		body = self._bodies.pop(seqno, None)
+		if body is None:
+			body = GetBodies(self._filename, [seqno],
+					 EXPAND_KEYWORDS)[seqno]
+		else:
+			BODY_CACHE.Removed(self, len(body))
+		return body
+
+	def BlobMark(self, imp, delta):
+		"""Return the mark of the blob holding the body of delta.
+
+		The blob of the parent is re-used if the body is the same and
+		the parent has already been imported, otherwise the body is
+		extracted and written as a new blob.
+
+		"""
+		mark = None
+		if delta.SameBodyAsParent():
+			mark = self._blob_marks.get(delta._parent_seqno)
+		if mark is None:
+			mark = imp.WriteBlob(self.GetBody(delta._seqno))
+		self._blob_marks[delta._seqno] = mark
+		return mark
+
 	def GoodRevision(self, sid):
 		comps = sid.split(".")
 		if len(comps) > 1 and all(int(x) > 0 for x in comps):
@@ -605,25 +992,74 @@ class SccsFile(object):
 class GitImporter(object):
 	"""Handles communications with git-fast-import."""
 
+	# The stream is written in many small pieces, so buffer it generously
+	# to keep the number of write(2) calls down.
+	BUFFER_SIZE = 1 << 20
+
+	# The number of completed commits which may be waiting to be written
+	# to git-fast-import before we stop and wait for it to catch up.
+	QUEUE_DEPTH = 64
+
 	def __init__(self, *args, **kwargs):
 		super(GitImporter, self).__init__(*args, **kwargs)
 		self._next_mark = 1
 		self._command = None
 		self._importer = None
-		self._write_to_stdout = False
+		self._out = None
+		self._pending = []
+		self._queue = None
+		self._pump = None
+		self._pump_error = None
 		self._used_tags = {}
+		self._blob_marks = {}
+		self._progress_percent = None
+		# Every commit starts the same way, up to its mark number.
+		self._commit_head = Encode("commit %s\nmark :" % (IMPORT_REF,))
 
 	def StartImporter(self):
-		args = ["git","fast-import"]
+		# No deltas are computed here since "git gc --aggressive" is
+		# run afterwards and will find better ones anyway, and only
+		# the one branch is ever being written to.
+		#
+		args = ["git", "fast-import", "--depth=0", "--active-branches=1"]
 		self._command = " ".join(args)
 		self._importer = subprocess.Popen(args,
+						  bufsize=self.BUFFER_SIZE,
 						  close_fds=True,
 						  stdin=subprocess.PIPE)
+		self._out = self._importer.stdin
+		self._queue = queue.Queue(self.QUEUE_DEPTH)
+		self._pump = threading.Thread(target=self.PumpToImporter,
+					      name="fast-import writer")
+		self._pump.daemon = True
+		self._pump.start()
+
+	def PumpToImporter(self):
+		"""Write each completed commit to git-fast-import.
+
+		This runs in its own thread so that git-fast-import can be kept
+		busy while the main thread is waiting for get(1).
+
+		"""
+		while True:
+			chunks = self._queue.get()
+			if chunks is None:
+				break
+			if self._pump_error:
+				continue	# just drain the queue
+			try:
+				self._out.writelines(chunks)
+				self._out.flush()
+			except OSError as oe:
+				self._pump_error = oe
 
 	def SendToStdout(self):
 		self._command = None
 		self._importer = None
-		self._write_to_stdout = True
+		sys.stdout.flush()
+		self._out = io.BufferedWriter(io.FileIO(sys.stdout.fileno(), "wb",
+							closefd=False),
+					      self.BUFFER_SIZE)
 
 	def GetNextMark(self):
 		"""Get the next unused idnum for a mark statement."""
@@ -631,30 +1067,84 @@ class GitImporter(object):
 		self._next_mark += 1
 		return result
 
-	def Write(self, s):
-		"""Write some data to the importer."""
-		if self._write_to_stdout:
-			sys.stdout.write(s)
+	def Write(self, *chunks):
+		"""Write some data (all bytes) to the importer.
+
+		Nothing is actually sent until the next Flush().
+
+		"""
+		assert self._out
+		self._pending.extend(chunks)
+
+	def Flush(self):
+		"""Send everything written so far on towards the importer.
+
+		If git-fast-import has already gone away then ImportFailure is
+		raised at once, rather than carrying on with the rest of the
+		import only for it all to be thrown away.
+
+		"""
+		if not self._pending:
+			return
+		if self._queue:
+			if self._pump_error:
+				raise ImportFailure("Failed writing to %s: %s"
+						    % (self._command, self._pump_error,))
+			returncode = self._importer.poll()
+			if returncode is not None:
+				raise ImportFailure("%s exited early, with status %d"
+						    % (self._command, returncode,))
+			self._queue.put(self._pending)
 		else:
-			assert self._importer
-			self._importer.stdin.write(s)
+			try:
+				self._out.writelines(self._pending)
+			except OSError as oe:
+				raise ImportFailure("Failed writing to stdout: %s"
+						    % (oe,))
+		self._pending = []
 
-	def Done(self):
+	def Done(self, aborting=False):
+		"""Finish the import, and wait for git-fast-import to finish.
+
+		If aborting then the import has already failed: whatever part of
+		a commit is pending is discarded, so that git-fast-import sees
+		the stream end without its "done" and fails too, and no further
+		failure is reported so as not to hide the original one.
+
+		"""
+		if self._out and not aborting:
+			self.Flush()
+		if self._pump:
+			self._queue.put(None)
+			self._pump.join()
+		if self._out and not self._importer:
+			self._out.flush()
 		if self._importer:
-			self._importer.stdin.close()
+			try:
+				self._importer.stdin.close()
+			except OSError:
+				pass	# the pump will have hit this too
 			returncode = self._importer.wait()
+			if aborting:
+				return
 			if returncode != 0:
-				ReportCommandFailure(self._command, returncode, None)
+				try:
+					ReportCommandFailure(self._command, returncode, None)
+				except CommandFailure as cmd_failure:
+					raise ImportFailure(cmd_failure)
+			elif self._pump_error:
+				raise ImportFailure("Failed writing to %s: %s"
+						    % (self._command, self._pump_error,))
 			else:
-				print >>sys.stderr, ("%s completed successfully"
-						     % (self._command,))
+				print("%s completed successfully" % (self._command,),
+				      file=sys.stderr)
 
 				output = RunCommand(["git",
 						     "--git-dir=%s" % (GitDir,),
 						     "--work-tree=%s" % (os.path.dirname(GitDir),),
 						     "gc", "--aggressive"]) # n.b. no --progress option!
 				if output and verbose:
-					print >>sys.stderr, ("git gc: %s" % (output,))
+					print("git gc: %s" % (Decode(output),), file=sys.stderr)
 
 				output = RunCommand(["git",
 						     "--git-dir=%s" % (GitDir,),
@@ -662,7 +1152,7 @@ class GitImporter(object):
 						     "checkout", "--progress",
 						     IMPORT_REF.rsplit('/', 1)[1], "--", "."])
 				if output and verbose:
-					print >>sys.stderr, ("git checkout: %s" % (output,))
+					print("git checkout: %s" % (Decode(output),), file=sys.stderr)
 
 
 	def ProgressMsg(self, msg):
@@ -670,41 +1160,57 @@ class GitImporter(object):
 		sys.stderr.write(msg)
 
 	def Progress(self, done, items):
-		"""Inform the user of our current progress."""
-		percent = (100.0 * float(done)) / float(items)
+		"""Inform the user of our current progress.
+
+		Nothing is written unless the percentage shown would change, so
+		this is cheap enough to call for every item.
+
+		"""
+		percent = done * 100 // items
 		if done == items:
 			tail = " done\n"
+		elif percent == self._progress_percent:
+			return
 		else:
 			tail = ""
+		self._progress_percent = percent
 
-		msg = "\r %3.0f%% (%d/%d)%s" % (percent, done, items, tail,)
+		msg = "\r %3d%% (%d/%d)%s" % (percent, done, items, tail,)
 		self.ProgressMsg(msg)
 
 	def WriteData(self, data):
 		"""Emit a data command followd by a blob of data."""
-		self.Write("data %d\n" % (len(data),))
-		self.Write(data)
-		self.Write("\n")
+		self.Write(b"data %d\n" % (len(data),), data, b"\n")
 
-	def BeginCommit(self, delta, parent):
-		"""Start a new commit (having the indicated parent)."""
+	def BeginCommit(self, delta, parent, base=None):
+		"""Start a new commit (having the indicated parent).
+
+		If there is no parent mark then the commit is made on top of
+		base, if given (i.e. an existing commit in the repository).
+		"""
 		mark = self.GetNextMark()
-		self.Write("commit %s\nmark :%d\n" % (IMPORT_REF, mark,))
-		ts = delta.GitTimestamp()
-		self.Write("committer %s %s\n"
-			   % (delta._ui.email, ts))
+		self.Write(self._commit_head, b"%d\n" % (mark,))
 
 		# Git's commit a965bb31166d04f3e5c8f7a93569fb73f9a9d749 added
 		# support for # original-oid in git-fast-import, and "git tag
-		# --contains a965bb31" tells me this will be v2.21.0 or newer:
+		# --contains a965bb31" tells me this will be v2.21.0 or newer.
+		# N.B.:  it must come before the committer line.
 		#
-		if LooseVersion(GitVer) >= LooseVersion("v2.21.0"):
-			self.Write("original-oid %s-%s\n"
-				   % (delta._sccsfile._filename, delta._seqno))
-
-		self.WriteData(delta.GitComment())
+		if GitVer >= (2, 21, 0):
+			self.Write(Encode("original-oid %s-%s\n"
+					  % (delta._sccsfile._filename, delta._seqno)))
+
+		comment = delta.GitComment()
+		self.Write(b"committer %s %s\ndata %d\n"
+			   % (delta._ui.email_bytes, Encode(delta._git_timestamp),
+			      len(comment)),
+			   comment)
 		if parent:
-			self.Write("from :%d\n" % (parent,))
+			self.Write(b"\nfrom :%d\n" % (parent,))
+		elif base:
+			self.Write(Encode("\nfrom %s\n" % (base,)))
+		else:
+			self.Write(b"\n")
 
 		return mark
 
@@ -717,7 +1223,7 @@ class GitImporter(object):
 		# add a tag "revision" number to avoid cases of "error: multiple
 		# updates for ref 'refs/tags/v18' not allowed" when release
 		# levels are not consistently incremented at release time....
-		if self._used_tags.has_key(tag):
+		if tag in self._used_tags:
 			self._used_tags[tag] += 1
 			trev = self._used_tags[tag]
 			tag = ("v%d.%d" % (pdelta.SidLevel(), trev,))
@@ -728,21 +1234,48 @@ class GitImporter(object):
 			self.ProgressMsg("\nNEW Tag: %s (for %s: %s)\n"
 					 % (tag, pdelta._sid, pdelta._comment.rstrip(),))
 
-		self.Write("tag %s\n" % (tag,))
-		self.Write("from :%d\n" % (parent,))
-		ts = pdelta.GitTimestamp()
-		self.Write("tagger %s %s\n"
-			   % (pdelta._ui.email, ts))
+		self.Write(Encode("tag %s\nfrom :%d\ntagger %s %s\n"
+				  % (tag, parent, pdelta._ui.email,
+				     pdelta._git_timestamp)))
 		self.WriteData(pdelta.GitComment())
 
-	def Filemodify(self, sfile, body):
+	def WriteBlob(self, body):
+		"""Write a blob (unless an identical one has already been
+		written) and return the mark which refers to it.
+		"""
+		digest = hashlib.blake2b(body, digest_size=16).digest()
+		mark = self._blob_marks.get(digest)
+		if mark is None:
+			mark = self.GetNextMark()
+			self._blob_marks[digest] = mark
+			self.Write(b"blob\nmark :%d\n" % (mark,))
+			self.WriteData(body)
+		return mark
+
+	def Filemodify(self, sfile, mark):
 		"""Write a filemodify section of a commit."""
-		self.Write("M %s inline %s\n" % (sfile.gitmode, sfile.gitname,))
-		self.WriteData(body)
+		head, tail = sfile._filemodify
+		self.Write(b"%s%d%s" % (head, mark, tail))
 
 	def CompleteCommit(self):
-		"""Write the final part of a commit."""
-		self.Write("\n")
+		"""Write the final part of a commit, and send the commit on."""
+		self.Write(b"\n")
+		self.Flush()
+
+	def BeginStream(self):
+		"""Ask git-fast-import to insist on an explicit end of stream.
+
+		Should we die part way through, git-fast-import will then fail
+		rather than quietly updating the branch with a partial import.
+
+		"""
+		self.Write(b"feature done\n")
+		self.Flush()
+
+	def EndStream(self):
+		"""Tell git-fast-import that the import is complete."""
+		self.Write(b"done\n")
+		self.Flush()
 
 
 # TODO: if the fuzzy commit logic puts subsequent deltas into the same
@@ -750,99 +1283,229 @@ class GitImporter(object):
 # One could argue that the timestamp of the last one would be a better choice.
 
 
-def ImportDeltas(imp, deltas):
+def ImportCommit(imp, deltas, parent, base=None):
+	"""Write one commit holding the given deltas, returning its mark.
+
+	The blobs have to be written first as git-fast-import does not
+	allow a blob command in the middle of a commit.
+	"""
+	marks = [d._sccsfile.BlobMark(imp, d) for d in deltas]
+	current = imp.BeginCommit(deltas[0], parent, base)
+	for d, mark in zip(deltas, marks):
+		imp.Filemodify(d._sccsfile, mark)
+	imp.CompleteCommit()
+	return current
+
+
+def ImportDeltas(imp, deltas, base=None):
 	if not deltas:
-		raise ImportFailure, "No deltas to import"
-	first_delta_in_commit = None
+		raise ImportFailure("No deltas to import")
+	commit_deltas = []
 	done = 0
+	total = len(deltas)
 	imp.ProgressMsg("\nCreating commits...\n")
+	imp.BeginStream()
 	plevel = None
 	parent = None
+	grandparent = None
 	pdelta = None
 	commit_count = 0
 	write_tag_next = False
 	for d in deltas:
-		imp.Progress(done, len(deltas))
+		imp.Progress(done, total)
 		done += 1
 		# Figure out if we need to start a new commit.
-		if first_delta_in_commit:
-			if not first_delta_in_commit.SameFuzzyCommit(d):
-				imp.CompleteCommit()
-				first_delta_in_commit = None
+		if commit_deltas:
+			if not commit_deltas[0].SameFuzzyCommit(d):
+				grandparent = parent
+				parent = ImportCommit(imp, commit_deltas, parent, base)
+				commit_deltas = []
 				if DoTags and write_tag_next:
-					imp.WriteTag(plevel, current - 1)
+					imp.WriteTag(plevel, grandparent)
 					write_tag_next = False
 
 				if plevel and d.SidLevel() > plevel.SidLevel() and d.SidRev() == 1:
 					write_tag_next = True
 
-		if first_delta_in_commit is None:
-			first_delta_in_commit = d
-			current = imp.BeginCommit(d, parent)
+		if not commit_deltas:
 			commit_count += 1
-			parent = current
 			if pdelta:
 				plevel = d
 
 		pdelta = d
 
-		# We're now in a commit.  Emit the body for this delta.
-		body = GetBody(d._sccsfile._filename, d._seqno, EXPAND_KEYWORDS)
-		imp.Filemodify(d._sccsfile, body)
+		# We're now in a commit.  Its body is emitted once the commit
+		# is complete.
+		commit_deltas.append(d)
 
 	# Finished looping over deltas
-	if parent:
-		imp.CompleteCommit()
+	if commit_deltas:
+		ImportCommit(imp, commit_deltas, parent, base)
+	imp.EndStream()
 
-	imp.Progress(done, len(deltas))
+	imp.Progress(done, total)
 	imp.ProgressMsg("\nDone.\n")
-	print >>sys.stderr, ("%d SCCS deltas in %d git commits"
-			     % (len(deltas), commit_count))
+	print("%d SCCS deltas in %d git commits" % (total, commit_count),
+	      file=sys.stderr)
+
+
+# The global settings which LoadSccsFile() depends upon, and which must
+# therefore be handed to each of the metadata worker processes.
+#
+WORKER_SETTINGS = ("GET", "PRS", "VAL",
+		   "MAIL_DOMAIN", "DEFAULT_USER_TZ", "AuthorMap",
+		   "MoveDate", "MoveOffset", "EXPAND_KEYWORDS",
+		   "STRICT_VALIDATE", "debug", "verbose")
+
+def ValidateWithVal(filename):
+	"""Returns True IFF val(1) finds no problems with the SCCS file."""
+	commandline = VAL.split(" ")
+	commandline.append(filename)
+	try:
+		RunCommand(commandline)
+		return True
+	except ImportFailure:
+		return False
+	except OSError as oe:
+		# i.e. val(1) could not be run at all
+		raise ImportFailure("%s failed: %s" % (VAL, oe,))
+
+
+def InitMetadataWorker(settings):
+	"""Set up a metadata worker process with our global settings."""
+	globals().update(settings)
+
 
+def LoadSccsFile(item):
+	"""Read the metadata of one SCCS file, in a worker process.
+
+	The item is a (filename, st_mode) pair.  Returns None if filename is
+	not a valid SCCS file.
+
+	"""
+	filename, st_mode = item
+	if STRICT_VALIDATE and not ValidateWithVal(filename):
+		NotImporting(filename, None, "%s reported errors" % (VAL,))
+		return None
+	try:
+		return SccsFile(filename, st_mode)
+	except NotSccsFile:
+		NotImporting(filename, None, "not a valid SCCS file")
+		return None
+	except OSError as oe:
+		raise ImportFailure("%s is not readable: %s"
+				    % (filename, oe.strerror,))
 
-def Import(filenames, stdout):
-	"""Import the indicated SCCS files into git."""
-	for filename in filenames:
-		if not os.access(filename, os.R_OK):
-			msg = "%s is not readable" % (filename,)
-			raise ImportFailure, msg
-		if not os.path.isfile(filename):
+
+def GitRefExists(ref):
+	"""Returns True IFF ref names an existing object in the git repo."""
+	return subprocess.call(["git", "rev-parse", "--verify", "--quiet", ref],
+			       stdout=subprocess.DEVNULL) == 0
+
+
+def ReadImportState():
+	"""Return the timestamp of the newest delta imported by a previous
+	run, or None if there was none.
+	"""
+	if not GitRefExists(STATE_REF):
+		return None
+	state = Decode(RunCommand(["git", "cat-file", "blob", STATE_REF]))
+	try:
+		return int(state.strip())
+	except ValueError:
+		raise ImportFailure("%s does not contain a timestamp: %s"
+				    % (STATE_REF, state,))
+
+
+def WriteImportState(timestamp):
+	"""Record the timestamp of the newest delta imported."""
+	oid = Decode(RunCommand(["git", "hash-object", "-w", "--stdin"],
+				input=b"%d\n" % (timestamp,))).strip()
+	RunCommand(["git", "update-ref", STATE_REF, oid])
+
+
+def Import(items, stdout, incremental=False):
+	"""Import the indicated SCCS files into git.
+
+	The items are (filename, st_mode) pairs, where st_mode is None if the
+	file has not already been stat()ed.
+
+	"""
+	worklist = []
+	for filename, st_mode in items:
+		# N.B.:  readability is not checked here -- an unreadable file
+		# will be reported when it is opened.
+		if st_mode is None:
+			try:
+				st_mode = os.stat(filename).st_mode
+			except OSError as oe:
+				raise ImportFailure("%s: %s" % (filename, oe.strerror,))
+		if not stat.S_ISREG(st_mode):
 			msg = "%s is not a file" % (filename,)
-			raise ImportFailure, msg
+			raise ImportFailure(msg)
+		worklist.append((filename, st_mode))
+	filenames = [filename for filename, st_mode in worklist]
 
 	sccsfiles = []
 	done = 0
 	imp = GitImporter()
 	imp.ProgressMsg("Reading metadata from SCCS files...\n")
-	for filename in filenames:
-		try:
-			imp.Progress(done, len(filenames))
-			if SccsFile.IsValidSccsFile(filename):
-				sf = SccsFile(filename)
-				sccsfiles.append(sf)
-			else:
-				NotImporting(filename, None, "not a valid SCCS file")
-
-			done += 1
-		except ImportFailure:
-			msg = ("\nAn import failure occurred while processing %s"
-			       % (filename,))
-			print >>sys.stderr, msg
-			raise
+	settings = dict([(name, globals()[name]) for name in WORKER_SETTINGS])
+	with concurrent.futures.ProcessPoolExecutor(
+			initializer=InitMetadataWorker,
+			initargs=(settings,)) as executor:
+		results = executor.map(LoadSccsFile, worklist, chunksize=8)
+		for filename in filenames:
+			try:
+				imp.Progress(done, len(filenames))
+				sf = next(results)
+				if sf:
+					sccsfiles.append(sf)
+
+				done += 1
+			except ImportFailure:
+				msg = ("\nAn import failure occurred while processing %s"
+				       % (filename,))
+				print(msg, file=sys.stderr)
+				raise
 
 	imp.Progress(done, len(filenames))
 
 	# Now we have all the metadata; sort the deltas by timestamp
-	# and import the deltas in time order.
+	# and import the deltas in time order.  Deltas made in the same
+	# second are ordered by filename and seqno so that the result does
+	# not depend on the order in which the directories were read.
 	#
-	delta_list = []
-	for sfile in sccsfiles:
-		for delta in sfile._deltas:
-			ts = "%020d" % (delta._timestamp,)
-			t = (ts, delta)
-			delta_list.append(t)
-
-	delta_list.sort()
+	delta_list = [d for sfile in sccsfiles for d in sfile._deltas]
+	delta_list.sort(key=operator.attrgetter('_timestamp',
+						'_sccsfile._filename',
+						'_seqno'))
+
+	base = None
+	if incremental:
+		last_timestamp = ReadImportState()
+		if GitRefExists(IMPORT_REF):
+			if last_timestamp is None:
+				# the whole history would be imported again on top
+				raise UsageError("The branch %s was not made by "
+						 "--incremental, as there is no %s"
+						 % (IMPORT_REF, STATE_REF,))
+			base = "%s^0" % (IMPORT_REF,)
+		elif last_timestamp is not None:
+			# only the newer deltas would be imported, on a new root
+			raise UsageError("There is a %s, but the branch %s "
+					 "it belongs to is missing"
+					 % (STATE_REF, IMPORT_REF,))
+		if last_timestamp is not None:
+			delta_list = [d for d in delta_list
+				      if d._timestamp > last_timestamp]
+			# Only the new deltas' bodies need be extracted.
+			for sfile in sccsfiles:
+				sfile._deltas = [d for d in sfile._deltas
+						 if d._timestamp > last_timestamp]
+			if not delta_list:
+				print("No new deltas to import", file=sys.stderr)
+				return 0
 
 	if stdout:
 		imp.SendToStdout()
@@ -850,9 +1513,14 @@ def Import(filenames, stdout):
 		imp.StartImporter()
 
 	try:
-		ImportDeltas(imp, [d[1] for d in delta_list])
-	finally:
-		imp.Done()
+		ImportDeltas(imp, delta_list, base)
+	except:
+		imp.Done(aborting=True)
+		raise
+	imp.Done()
+
+	if incremental:
+		WriteImportState(delta_list[-1]._timestamp)
 
 
 def IsValidGitDir(path):
@@ -870,11 +1538,11 @@ def IsValidGitDir(path):
 def FindGitDir(gitdir, init):
 	"""Locate the git repository."""
 	if not gitdir:
-		gitdir = RunCommand(["git", "rev-parse", "--git-dir"])
+		gitdir = Decode(RunCommand(["git", "rev-parse", "--git-dir"]))
 		if gitdir:
 			gitdir = gitdir.strip()
 		else:
-			cdup = RunCommand(["git", "rev-parse", "--show-cdup"])
+			cdup = Decode(RunCommand(["git", "rev-parse", "--show-cdup"]))
 			if cdup:
 				gitdir = os.path.abspath(cdup.strip())
 			else:
@@ -894,50 +1562,76 @@ def FindGitDir(gitdir, init):
 			gitdir += "/.git"
 
 		if IsValidGitDir(gitdir):
-			raise ImportFailure, ("Git repository %s was already initialised"
+			raise ImportFailure("Git repository %s was already initialised"
 					      % (gitdir,))
 		else:
 			msg = ("Initializing repository: git --git-dir=%s init"
 			       % (gitdir,))
-			print >>sys.stderr, msg
-			output = RunCommand(["git", "--git-dir=%s" % (gitdir,), "init"])
+			print(msg, file=sys.stderr)
+			output = Decode(RunCommand(["git", "--git-dir=%s" % (gitdir,), "init"]))
 			if output and verbose:
-				print >>sys.stderr, ("git init: %s" % (output,))
+				print("git init: %s" % (output,), file=sys.stderr)
 
 	if not IsValidGitDir(gitdir):
 		gitdir += "/.git"
 		if not IsValidGitDir(gitdir):
-			raise ImportFailure, ("cannot locate git repository at %s"
+			raise ImportFailure("cannot locate git repository at %s"
 					      % (gitdir,))
 
-	print >>sys.stderr, ("git repository: %s"
-			     % (gitdir,))
+	print("git repository: %s" % (gitdir,), file=sys.stderr)
 
 	return gitdir
 
 
+def WalkSccsFiles(dirname):
+	"""Generate (pathname, st_mode) pairs for all the s. files under dirname.
+
+	The file type comes from the directory entry itself, so (unlike with
+	os.walk() plus os.access()) only the s. files need to be stat()ed
+	here, and their modes are passed along so that they need not be
+	stat()ed again; an unreadable file will be reported when we try to
+	import it.  Symlinks to s. files are followed, but symlinks to
+	directories are not.
+
+	"""
+	try:
+		entries = list(os.scandir(dirname))
+	except OSError as oe:
+		print("Warning: cannot search %s: %s" % (dirname, oe.strerror,),
+		      file=sys.stderr)
+		return
+
+	for entry in entries:
+		if entry.is_dir(follow_symlinks=False):
+			yield from WalkSccsFiles(entry.path)
+		elif entry.name.startswith("s.") and entry.is_file():
+			# n.b. a symlink to an s. file is imported as the file
+			try:
+				st_mode = entry.stat().st_mode
+			except OSError as oe:
+				print("Warning: cannot stat %s: %s"
+				      % (entry.path, oe.strerror,), file=sys.stderr)
+				continue
+			yield entry.path, st_mode
+
+
 def MakeDirWorklist(dirs):
 	result = []
 	for dirname in dirs:
-		# XXX it would be good to be able to report errors herein,
-		# especially permission denied, etc....
-		for root, subdirs, files in os.walk(dirname):
-			for f in files:
-				if f.startswith("s."):
-					physpath = os.path.join(root, f)
-					if os.access(physpath, os.R_OK):
-						result.append(physpath)
+		result.extend(WalkSccsFiles(dirname))
 
 	if not result:
-		print >>sys.stderr, ("Warning: No SCCS files were found in %s"
-				     % (" ".join(dirs)))
+		print("Warning: No SCCS files were found in %s" % (" ".join(dirs)),
+		      file=sys.stderr)
 	return result
 
 
 # The author map should match the format of git-cvsimport:
 #
-# XXX currently the [time/zone] option requires the ISO8601 basic format,
-# i.e. "[+-]hhmm", e.g. "-0800".
+# The [time/zone] is either a UTC offset in the ISO8601 basic format,
+# i.e. "[+-]hhmm", e.g. "-0800", or the name of a zone from the tz
+# database, e.g. "America/Toronto", in which case daylight saving time
+# is taken into account.
 #
 # <username>=Full Name <email@addre.ss> [time/zone]
 #
@@ -945,37 +1639,54 @@ def MakeDirWorklist(dirs):
 #
 #	exon=Andreas Ericsson <ae@op5.se>
 #	spawn=Simon Pawn <spawn@frog-pond.org> -0400
+#	jdoe=Jane Doe <jdoe@example.org> America/Toronto
 #
 # Comment lines, beginning with a '#', are ignored.
 #
 class UserInfo():
+	# One of these is kept for every committer, and shared by their deltas.
+	__slots__ = ("login", "email", "email_bytes", "tz")
+
 	def __init__(self, login, email, tz):
 		self.login = login
 		self.email = email
+		self.email_bytes = Encode(email)
 		self.tz = tz
 
 def GetAuthorMap(filename):
 	map = {}
 	with open(filename, 'r') as fd:
-		for line in fd:
-			if line[0] == '#':
-				continue
-			(k, v) = line.split('=')
-			v = v.strip()
-			if not v:
-				# ignore usernames with no info
-				continue
-			sp = v.rsplit(None, 1)
-			tz = DEFAULT_USER_TZ
-			if sp[-1].find('/') > -1:
-				tz = FindUTCOffset(sp[-1]) # XXX ToDo ???
-				v = sp[0]
-			elif sp[-1][0] == '+' or sp[-1][0] == '-':
-				assert int(sp[-1])
-				tz = sp[-1]
-				v = sp[0]
-
-			map[k.strip()] = UserInfo(k, v, tz)
+		lines = fd.read().splitlines()
+	for line_no, line in enumerate(lines, 1):
+		# skip blank lines as well as comments
+		stripped = line.lstrip()
+		if not stripped or stripped[0] == '#':
+			continue
+		(k, eq, v) = line.partition('=')
+		if not eq:
+			raise UsageError("Invalid syntax in author map %s at line %d: %s"
+					 % (filename, line_no, line.rstrip(),))
+		k = k.strip()
+		v = v.strip()
+		if not v:
+			# ignore usernames with no info
+			continue
+		sp = v.rsplit(None, 1)
+		tz = DEFAULT_USER_TZ
+		if sp[-1].find('/') > -1:
+			try:
+				GetZone(sp[-1])
+			except (KeyError, ValueError):
+				raise UsageError("Unknown time zone in author map %s "
+						 "at line %d: %s"
+						 % (filename, line_no, sp[-1],))
+			tz = sp[-1]
+			v = sp[0]
+		elif UTC_OFFSET_RE.fullmatch(sp[-1]):
+			tz = sp[-1]
+			v = sp[0]
+
+		map[k] = UserInfo(k, v, tz)
 
 	return map
 
@@ -985,28 +1696,39 @@ def GitUser(username, login_name, mail_domain):
 		return "%s <%s@%s>" % (username, login_name, mail_domain,)
 	return "%s <%s>" % (username, login_name,)
 
+@functools.lru_cache(maxsize=None)
 def GetUserInfo(login_name, mail_domain, tz):
-	"""Get a user's info corresponding to the given login name."""
+	"""Get a user's info corresponding to the given login name.
+
+	The result is cached, as there are usually very few distinct
+	committers but very many deltas, and getpwnam() can be slow.
+
+	"""
 	if AuthorMap:
-		return AuthorMap.get(login_name,
-				     UserInfo(login_name,
-					      GitUser(login_name, login_name, mail_domain),
-					      tz))
+		ui = AuthorMap.get(login_name)
+		if ui is not None:
+			return ui
+		return UserInfo(login_name,
+				GitUser(login_name, login_name, mail_domain),
+				tz)
 	try:
 		gecos = pwd.getpwnam(login_name).pw_gecos
 	except:
 		if verbose:
-			print >>sys.stderr, ("%s: unknown login" % (login_name,))
+			print("%s: unknown login" % (login_name,), file=sys.stderr)
 
 		return UserInfo(login_name,
 				GitUser(login_name, login_name, mail_domain),
 				tz)
 	username = gecos.split(",")[0]
-	string.replace(username, "&", string.capitalize(login_name))
+	# By old Unix convention an "&" in the full name stands for the login.
+	if "&" in username:
+		username = username.replace("&", login_name.capitalize())
 	return UserInfo(login_name, GitUser(username, login_name, mail_domain), tz)
 
 def ParseOptions(argv):
 	global IMPORT_REF
+	global STATE_REF
 	global MAIL_DOMAIN
 	global FUZZY_WINDOW
 	global EXPAND_KEYWORDS
@@ -1014,6 +1736,11 @@ def ParseOptions(argv):
 	global MoveDate
 	global MoveOffset
 	global DoTags
+	global USE_GET
+	global STRICT_VALIDATE
+	global GET
+	global PRS
+	global VAL
 	global verbose
 	global AuthorMap
 
@@ -1046,6 +1773,9 @@ def ParseOptions(argv):
 			  help="Directory containing the git repository")
 	parser.add_option("--init", default=False, action="store_true",
 			  help="Initialise the git repository first")
+	parser.add_option("--incremental", default=False, action="store_true",
+			  help=("Only import deltas newer than those imported "
+				"by the last --incremental run"))
 	parser.add_option("--move-date",
 			  help=("set the date SCCS files moved between timezones"
 				" (in ISO8601 form: YYYY/MM/DDTHH:MM:SS)"))
@@ -1057,6 +1787,12 @@ def ParseOptions(argv):
 	parser.add_option("--stdout", default=False, action="store_true",
 			  help=("Send git-fast-import data to stdout "
 				"rather than to git-fast-import"))
+	parser.add_option("--strict-validate", default=False, action="store_true",
+			  help=("Check each SCCS file with val(1) first, "
+				"and skip any with errors"))
+	parser.add_option("--use-get", default=False, action="store_true",
+			  help=("Always extract delta bodies with get(1) "
+				"instead of reading them from the SCCS files"))
 	parser.add_option("--use-sccs", default=False, action="store_true",
 			  help=("Use the 'sccs' front-end for SCCS commands"
 				" (by default need for 'sccs' is auto-detected)"))
@@ -1074,12 +1810,20 @@ def ParseOptions(argv):
 		MAIL_DOMAIN = options.maildomain
 
 	if options.tz:
-		# xxx verify it is in the correct format!
+		if not UTC_OFFSET_RE.fullmatch(options.tz):
+			raise UsageError("Bad --tz, expected [+-]hhmm: %s"
+					 % (options.tz,))
 		DEFAULT_USER_TZ = options.tz
 
 	if options.no_tags:
 		DoTags = False
 
+	if options.use_get:
+		USE_GET = True
+
+	if options.strict_validate:
+		STRICT_VALIDATE = True
+
 	if options.use_sccs:
 		GET = "sccs get"
 		PRS = "sccs prs"
@@ -1089,8 +1833,10 @@ def ParseOptions(argv):
 		if not options.move_offset:
 			raise UsageError("--move-date requires --move-offset")
 		try:
+			# kept as "wall clock" seconds, to compare with each delta's
 			MoveDate = datetime.datetime.strptime(options.move_date,
 							      '%Y/%m/%dT%H:%M:%S')
+			MoveDate = calendar.timegm(MoveDate.timetuple())
 		except:
 			raise UsageError("Bad --move-date")
 		try:
@@ -1108,6 +1854,7 @@ def ParseOptions(argv):
 				 "should be a number, but you specified '%s'"
 				 % (options.fuzzy_commit_window,))
 	IMPORT_REF = "refs/heads/%s" % (options.branch,)
+	STATE_REF = "refs/sccsimport/%s" % (options.branch,)
 	return options, args
 
 
@@ -1117,25 +1864,28 @@ def main(argv):
 
 	global GitDir
 	global GitVer
-	GitVer = RunCommand(["git", "--version"]).split(" ")[-1]
+	# e.g. "git version 2.39.2 (Apple Git-143)" gives (2, 39, 2)
+	m = re.search(r"\d+(\.\d+)*", Decode(RunCommand(["git", "--version"])))
+	GitVer = tuple([int(n) for n in m.group(0).split(".")]) if m else ()
 
+	# Use the SCCS commands directly if they are in $PATH, otherwise go
+	# via the sccs(1) front end.  --use-sccs can force the latter.
+	#
 	global GET
 	global PRS
 	global VAL
-	try:
-		RunCommand("prs".split(" "))
-	except ImportFailure:
+	if shutil.which("prs"):
 		GET = "get"
 		PRS = "prs"
 		VAL = "val"
-	except OSError:
+	else:
 		GET = "sccs get"
 		PRS = "sccs prs"
 		VAL = "sccs val"
 
 	try:
 		options, args = ParseOptions(argv)
-		#print >>sys.stderr, ("Positional args:", " ".join(args))
+		#print("Positional args:", " ".join(args), file=sys.stderr)
 		args = args[1:]
 		if not args:
 			if options.dirs:
@@ -1147,39 +1897,45 @@ def main(argv):
 			raise UsageError("The --init option is incompatible "
 					 "with the --stdout option")
 
+		if options.stdout and options.incremental:
+			raise UsageError("The --incremental option is incompatible "
+					 "with the --stdout option")
+
 		if not options.stdout:
 			try:
 				GitDir = FindGitDir(options.git_dir, options.init)
 				os.environ["GIT_DIR"] = GitDir
-			except ImportFailure, init_failure:
+			except ImportFailure as init_failure:
 				if options.init:
 					action = "Initialisation"
 				else:
 					action = "Locate"
 
-				print >>sys.stderr, ("%s failed:\n%s" % (action, init_failure,))
+				print("%s failed:\n%s" % (action, init_failure,), file=sys.stderr)
 				return 1
 
 		if options.dirs:
 			items = MakeDirWorklist(args)
 		else:
-			items = args
+			items = [(filename, None) for filename in args]
 
 		if len(items) <= 0:
-			print >>sys.stderr, "No items to import!"
+			print("No items to import!", file=sys.stderr)
 			return 1
 
 		if debug:
-			print >>sys.stderr, ("Importing %d items:" % (len(items),), " ".join(items))
+			print("Importing %d items:" % (len(items),),
+			      " ".join([filename for filename, st_mode in items]),
+			      file=sys.stderr)
 		else:
-			print >>sys.stderr, ("Importing %d items..." % (len(items),))
+			print("Importing %d items..." % (len(items),), file=sys.stderr)
 
-		return Import(items, options.stdout)
+		return Import(items, options.stdout, options.incremental)
 
-	except UsageError, usage_err:
+	except UsageError as usage_err:
 		return Usage(progname, 1, sys.stderr, usage_err)
-	except ImportFailure, imp_failure:
-		print >>sys.stderr, ("Import failed: %s" % (imp_failure,))
+	except ImportFailure as imp_failure:
+		print("Import failed: %s" % (imp_failure,), file=sys.stderr)
 		return 1
 
 def using(point=""):
@@ -1188,7 +1944,7 @@ def using(point=""):
 
 if __name__ == '__main__':
 	rc = main(sys.argv)
-	print >>sys.stderr, using(progname)
+	print(using(progname), file=sys.stderr)
 	sys.exit(rc)
 
 # Local Variables: